@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+'''
+Bulk position analysis over arrays of boards.
+Boards of shape (N, ROW, COL) are given as an array or a .npy file, which is memory-mapped.
+Chunks of boards are searched in a process pool, and every worker writes its results straight
+into preallocated output arrays, in shared memory or in .npy files memory-mapped from disk.
+
+Outputs
+visit_times (N, actions_num) int32 : Visit times of root children, by std_action
+quality (N, actions_num) float32 : Mean Q of root children, nan if not visited
+action (N,) int32 : Chosen std_action, -1 if the game is over
+Symmetric actions share one child in the tree, so every action of a group gets the stats of its child.
+Boards with a single move up to symmetry are not searched: their action is set, but visit_times
+is 0 and quality is nan for all actions. Illegal actions are also 0 and nan.
+
+Usage: python analysis.py boards.npy --output results/
+'''
+import os
+import io
+import argparse
+import contextlib
+import numpy as np
+from multiprocessing import Pool
+from multiprocessing import shared_memory
+
+from game import Game
+from mcts_pure import mcts
+
+
+OUTPUTS = {'visit_times': np.int32, 'quality': np.float32, 'action': np.int32}
+
+# Arrays attached by each worker process
+worker = {}
+
+
+def open_array(spec, shape, dtype):
+    '''
+    Attach an array described by spec (tuple): ('shm', name) or ('npy', path).
+
+    Returns
+    -------
+    array (np.array)
+    shm (SharedMemory or None): Keep a reference while the array is in use
+
+    '''
+    kind, name = spec
+    if kind == 'npy':
+        return np.load(name, mmap_mode='r+'), None
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def init_worker(board_spec, output_specs, n, config):
+    '''
+    Attach boards and outputs of a worker process.
+    '''
+    game = Game()
+    worker['game'] = game
+    worker['shms'] = []
+    if board_spec[0] == 'npy':
+        worker['boards'] = np.load(board_spec[1], mmap_mode='r')
+    else:
+        worker['boards'], shm = open_array(board_spec, (n, game.ROW, game.COL), np.int8)
+        worker['shms'].append(shm)
+    for key, dtype in OUTPUTS.items():
+        shape = (n,) if key == 'action' else (n, game.actions_num)
+        worker[key], shm = open_array(output_specs[key], shape, dtype)
+        worker['shms'].append(shm)
+    worker['config'] = config
+
+
+def create_agent():
+    '''
+    Create an agent for one board, so that its results do not depend on boards searched
+    before it (the tree cache would resume trees of repeated or symmetric boards).
+    '''
+    agent = mcts()
+    agent.set_env_model(worker['game'])
+    for key, value in worker['config'].items():
+        setattr(agent, key, value)
+    return agent
+
+
+def analyze_chunk(chunk):
+    '''
+    Search boards[start:stop] and write results into the output arrays.
+
+    Returns
+    -------
+    num (int): Number of boards analyzed
+
+    '''
+    start, stop = chunk
+    game = worker['game']
+    boards = np.asarray(worker['boards'][start:stop], dtype=float)
+    masks = game.get_legal_actions_batch(boards)
+    visit_times, quality, actions = worker['visit_times'], worker['quality'], worker['action']
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(stop - start):
+            n = start + i
+            visit_times[n] = 0
+            quality[n] = np.nan
+            legal_actions = np.flatnonzero(masks[i]).tolist()
+            if legal_actions == []:
+                actions[n] = -1
+                continue
+
+            state = {'obs': boards[i], 'legal_actions': legal_actions}
+            unique_actions = game.get_unique_actions(state)
+            if len(unique_actions) == 1: # forced move, no search needed
+                actions[n] = unique_actions[0]
+                continue
+
+            agent = create_agent()
+            action = None
+            while action is None:
+                action = agent.step(state)
+            actions[n] = action
+            # A fresh agent is rooted at the board itself, so children actions are in its frame
+            for sub_node in agent.root_node.get_children():
+                group = agent.root_node.get_action_group(sub_node.get_action_to_state())
+                visit_times[n, group] = sub_node.get_visit_times()
+                quality[n, group] = sub_node.get_quality_value() / sub_node.get_visit_times()
+    return stop - start
+
+
+def analyze_boards(boards, rollouts=100, config=None, processes=None, chunk_size=256, output=None):
+    '''
+    Analyze a batch of boards with MCTS.
+
+    Parameters
+    ----------
+    boards (np.array or str): Boards of shape (N, ROW, COL), or path of a .npy file of them
+    rollouts (int): Rollout budget of each board
+    config (dict): Other mcts attributes, e.g. {'early_stop': False}
+    processes (int): Number of worker processes, default os.cpu_count()
+    chunk_size (int): Boards of each task
+    output (str): Directory to write visit_times.npy, quality.npy and action.npy,
+    results are kept in memory if None
+
+    Returns
+    -------
+    results (dict): {'visit_times': np.array, 'quality': np.array, 'action': np.array}
+
+    '''
+    game = Game()
+    config = dict(config or {}, rollout_budget=rollouts)
+    shms = []
+
+    if isinstance(boards, str):
+        board_spec = ('npy', boards)
+        n = np.load(boards, mmap_mode='r').shape[0]
+    else:
+        n = len(boards)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, n * game.ROW * game.COL))
+        np.ndarray((n, game.ROW, game.COL), dtype=np.int8, buffer=shm.buf)[:] = boards
+        board_spec = ('shm', shm.name)
+        shms.append(shm)
+
+    # Preallocate outputs
+    results, output_specs = {}, {}
+    for key, dtype in OUTPUTS.items():
+        shape = (n,) if key == 'action' else (n, game.actions_num)
+        if output is not None:
+            os.makedirs(output, exist_ok=True)
+            path = os.path.join(output, key + '.npy')
+            results[key] = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+            output_specs[key] = ('npy', path)
+        else:
+            size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            results[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            output_specs[key] = ('shm', shm.name)
+            shms.append(shm)
+
+    chunks = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    try:
+        with Pool(processes, initializer=init_worker, initargs=(board_spec, output_specs, n, config)) as pool:
+            pool.map(analyze_chunk, chunks)
+        if output is None:
+            # Copy out of shared memory before it is released
+            results = {key: array.copy() for key, array in results.items()}
+        return results
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+###########################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk position analysis')
+    parser.add_argument('boards', help='.npy file of boards with shape (N, ROW, COL)')
+    parser.add_argument('--output', required=True, help='directory of result .npy files')
+    parser.add_argument('--rollouts', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=256)
+    args = parser.parse_args()
+
+    results = analyze_boards(args.boards, args.rollouts, processes=args.processes,
+                             chunk_size=args.chunk_size, output=args.output)
+    print('analyzed {} boards, results in {}'.format(len(results['action']), args.output))
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+'''
+Playing strength vs compute benchmark.
+Play a fixed, seeded set of episodes from every initial point of Game.reset,
+under several rollout budgets and wall time budgets, for two agent configurations.
+An agent configuration is a dict of mcts attributes, e.g. {'early_stop': False}.
+
+Usage: python benchmark.py --baseline '{"early_stop": false}' --candidate '{}'
+'''
+import os
+import sys
+import io
+import csv
+import json
+import time
+import random
+import argparse
+import contextlib
+import numpy as np
+from multiprocessing import Pool
+
+from game import Game
+from mcts_pure import mcts
+
+
+BASELINE = {'early_stop': False}
+CANDIDATE = {}
+
+
+def play_episode(task):
+    '''
+    Play one episode with a fresh agent.
+
+    Parameters
+    ----------
+    task (tuple): (config, kind, budget, init_point, seed)
+    kind is 'rollouts' (budget is rollout times of each move)
+    or 'seconds' (budget is wall time of each move)
+
+    Returns
+    -------
+    reward (int)
+    cpu_time (float): CPU seconds used by the episode
+
+    '''
+    config, kind, budget, init_point, seed = task
+    random.seed(seed)
+
+    game = Game()
+    game.reset(init_point)
+    agent = mcts()
+    agent.set_env_model(Game())
+    for key, value in config.items():
+        setattr(agent, key, value)
+    if kind == 'rollouts':
+        agent.rollout_budget = budget
+    else:
+        agent.rollout_budget = sys.maxsize
+        agent.time_budget = budget
+
+    reward = 0
+    start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while game.is_end() is not True:
+            game.state['legal_actions'] = game.get_legal_actions(game.state)
+            action = agent.step(game.state)
+            if action is not None:
+                state, action, next_state, reward, done = game.step(action)
+    return float(reward), time.process_time() - start
+
+
+def run_config(config, kind, budgets, episodes, seed, pool):
+    '''
+    Run episodes of one configuration under all budgets of one kind.
+    Every budget uses the same seeds, so configurations are compared on the same episodes.
+
+    Returns
+    -------
+    points (list of dict): One point of score-vs-compute curve for each budget,
+    rewards of its episodes are kept in order of seeds for paired comparison
+
+    '''
+    max_reward = Game().get_reward_range()[1]
+    points = []
+    for budget in budgets:
+        tasks = []
+        for i, init_point in enumerate(Game().initial_points):
+            for j in range(episodes):
+                tasks.append((config, kind, budget, init_point, seed + i*episodes + j))
+        results = pool.map(play_episode, tasks)
+        rewards = np.array([r for r, t in results])
+        cpu_times = np.array([t for r, t in results])
+        values, counts = np.unique(rewards, return_counts=True)
+        points.append({'kind': kind,
+                       'budget': budget,
+                       'episodes': len(tasks),
+                       'mean_reward': rewards.mean(),
+                       'std_reward': rewards.std(),
+                       'optimal_rate': (rewards == max_reward).mean(),
+                       'cpu_time': cpu_times.mean(),
+                       'distribution': {int(v): int(c) for v, c in zip(values, counts)},
+                       'rewards': rewards})
+    return points
+
+
+def compare(baseline_points, candidate_points, k=2.0, tolerance=0.0):
+    '''
+    Compare mean reward at the same budget, separately for each kind of budget.
+    Both configurations play the same seeds, so rewards are compared episode by episode.
+    A point fails if the mean drop is larger than tolerance + k * SE,
+    where SE is the standard error of the mean of paired differences.
+
+    Returns
+    -------
+    failures (list of str)
+
+    '''
+    failures = []
+    candidates = {(p['kind'], p['budget']): p for p in candidate_points}
+    for p in baseline_points:
+        c = candidates.get((p['kind'], p['budget']))
+        if c is None:
+            failures.append('{} {}: no candidate point at this budget'.format(p['kind'], p['budget']))
+            continue
+        diff = c['rewards'] - p['rewards']
+        se = diff.std(ddof=1) / np.sqrt(len(diff)) if len(diff) > 1 else 0.0
+        drop = -diff.mean()
+        if drop > tolerance + k * se:
+            failures.append('{} {}: candidate {:.3f} < baseline {:.3f}, drop {:.3f} > {:.3f} + {} * SE {:.3f}'.format(
+                p['kind'], p['budget'], c['mean_reward'], p['mean_reward'], drop, tolerance, k, se))
+    if baseline_points == []:
+        failures.append('no points to compare')
+    return failures
+
+
+def save_curve_as_csv(path, results):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['config', 'kind', 'budget', 'episodes', 'mean_reward', 'std_reward',
+                         'optimal_rate', 'cpu_time', 'distribution'])
+        for name, points in results.items():
+            for p in points:
+                writer.writerow([name, p['kind'], p['budget'], p['episodes'], p['mean_reward'],
+                                 p['std_reward'], p['optimal_rate'], p['cpu_time'],
+                                 json.dumps(p['distribution'])])
+
+
+def print_curve(results):
+    print('{:<10}{:<10}{:>8}{:>8}{:>8}{:>10}{:>10}  {}'.format(
+        'config', 'kind', 'budget', 'mean', 'std', 'optimal', 'cpu(s)', 'distribution'))
+    for name, points in results.items():
+        for p in points:
+            print('{:<10}{:<10}{:>8}{:>8.3f}{:>8.3f}{:>10.3f}{:>10.3f}  {}'.format(
+                name, p['kind'], p['budget'], p['mean_reward'], p['std_reward'],
+                p['optimal_rate'], p['cpu_time'], p['distribution']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Playing strength vs compute benchmark')
+    parser.add_argument('--baseline', type=json.loads, default=BASELINE, help='mcts attributes as json')
+    parser.add_argument('--candidate', type=json.loads, default=CANDIDATE, help='mcts attributes as json')
+    parser.add_argument('--rollouts', type=int, nargs='*', default=[10, 25, 50, 100])
+    parser.add_argument('--seconds', type=float, nargs='*', default=[0.01, 0.05])
+    parser.add_argument('--episodes', type=int, default=4, help='episodes of each initial point')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--k', type=float, default=2.0, help='allowed drop of mean reward in standard errors')
+    parser.add_argument('--tolerance', type=float, default=0.0, help='allowed drop of mean reward besides k * SE')
+    parser.add_argument('--output', default='benchmark.csv')
+    args = parser.parse_args()
+
+    results = {'baseline': [], 'candidate': []}
+    with Pool(args.processes) as pool:
+        for name, config in (('baseline', args.baseline), ('candidate', args.candidate)):
+            for kind, budgets in (('rollouts', args.rollouts), ('seconds', args.seconds)):
+                results[name] += run_config(config, kind, budgets, args.episodes, args.seed, pool)
+
+    print_curve(results)
+    save_curve_as_csv(args.output, results)
+
+    failures = compare(results['baseline'], results['candidate'], args.k, args.tolerance)
+    for failure in failures:
+        print('FAIL ' + failure)
+    return 1 if failures else 0
+
+
+###########################################################
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+'''
+Distributed root parallel MCTS over plain TCP.
+A coordinator sends the root state and a budget to every worker, each worker builds its own
+tree and returns the statistics of root children, and the coordinator merges them by action.
+Workers that fail or do not answer before the deadline are ignored.
+
+Messages are json objects, each prefixed with its length as a 4 bytes big-endian integer.
+request = {'obs': obs (list), 'legal_actions': legal_actions (list), 'rollouts': int, 'seconds': float, 'seed': int}
+response = {'children': [[action, visit_times, quality_value], ...], 'rollouts': int}
+
+Usage on one box, workers listen on localhost ports as stand-ins for nodes:
+python distributed.py worker --port 5000
+python distributed.py demo --workers 4 --port 5000
+'''
+import io
+import json
+import time
+import socket
+import struct
+import random
+import argparse
+import threading
+import contextlib
+import socketserver
+import numpy as np
+from multiprocessing import Process
+
+from game import Game
+from mcts_pure import mcts
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+
+def recv_exactly(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return data
+
+
+def recv_message(sock):
+    (n,) = struct.unpack('>I', recv_exactly(sock, 4))
+    return json.loads(recv_exactly(sock, n).decode('utf-8'))
+
+
+# mcts draws from the module-level random, so seeded searches are run one at a time
+search_lock = threading.Lock()
+
+
+def search_root(state, rollouts, seconds, seed=None):
+    '''
+    Run a local search from the root state, stop when rollouts are used up or time is out.
+    Searches of concurrent requests are serialized, so that each one is reproducible from its seed.
+
+    Returns
+    -------
+    response (dict): {'children': [[action, visit_times, quality_value], ...], 'rollouts': int}
+
+    '''
+    deadline = time.time() + seconds
+    with search_lock, contextlib.redirect_stdout(io.StringIO()):
+        if seed is not None:
+            random.seed(seed)
+        agent = mcts()
+        agent.set_env_model(Game())
+        agent.rollout_budget = rollouts
+        agent.create_new_tree(state)
+        while agent.rest_rollout_times > 0 and time.time() < deadline:
+            agent.rollout()
+    children = [[n.get_action_to_state(), n.get_visit_times(), n.get_quality_value()]
+                for n in agent.root_node.get_children()]
+    return {'children': children, 'rollouts': rollouts - agent.rest_rollout_times}
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    '''
+    Answer search requests of a coordinator until the connection is closed.
+    '''
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except ConnectionError:
+                break
+            state = {'obs': np.array(request['obs'], dtype=float),
+                     'legal_actions': request['legal_actions']}
+            response = search_root(state, request['rollouts'], request['seconds'], request.get('seed'))
+            send_message(self.request, response)
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def run_worker(port, host='127.0.0.1'):
+    with WorkerServer((host, port), WorkerHandler) as server:
+        server.serve_forever()
+
+
+def start_local_workers(num, port):
+    '''
+    Start num worker processes on localhost ports port, port+1, ...
+
+    Returns
+    -------
+    processes (list of Process)
+    addresses (list of tuple): [(host, port), ...]
+
+    '''
+    processes, addresses = [], []
+    for i in range(num):
+        p = Process(target=run_worker, args=(port + i,), daemon=True)
+        p.start()
+        processes.append(p)
+        addresses.append(('127.0.0.1', port + i))
+    return processes, addresses
+
+
+class Coordinator(object):
+    '''
+    Spread the search of one move over workers and merge root children statistics.
+    '''
+    def __init__(self, addresses, rollout_budget=100, time_budget=1.0, grace=0.2):
+        self.addresses = addresses
+        self.env_model = Game()
+        self.rollout_budget = rollout_budget # total rollout times of each move
+        self.time_budget = time_budget # seconds of each move
+        self.grace = grace # extra seconds allowed for network
+        self.last_workers = [] # addresses of workers that answered the last search
+
+    def query_worker(self, address, request, results):
+        try:
+            with socket.create_connection(address, timeout=self.time_budget + self.grace) as sock:
+                send_message(sock, request)
+                results[address] = recv_message(sock)
+        except (OSError, ValueError):
+            pass # lost or straggling worker
+
+    def search(self, state):
+        '''
+        Send the root state to all workers and merge answers received before the deadline.
+
+        Returns
+        -------
+        stats (dict): {action: [visit_times, quality_value]}
+
+        '''
+        rollouts = -(-self.rollout_budget // len(self.addresses))
+        results, threads = {}, []
+        for i, address in enumerate(self.addresses):
+            request = {'obs': state['obs'].tolist(),
+                       'legal_actions': state['legal_actions'],
+                       'rollouts': rollouts,
+                       'seconds': self.time_budget,
+                       'seed': random.randrange(2**31) + i}
+            t = threading.Thread(target=self.query_worker, args=(address, request, results), daemon=True)
+            t.start()
+            threads.append(t)
+
+        deadline = time.time() + self.time_budget + self.grace
+        for t in threads:
+            t.join(max(0.0, deadline - time.time()))
+
+        stats, results = {}, dict(results)
+        self.last_workers = list(results.keys())
+        for response in results.values():
+            for action, visit_times, quality_value in response['children']:
+                stats.setdefault(action, [0, 0.0])
+                stats[action][0] += visit_times
+                stats[action][1] += quality_value
+        return stats
+
+    def step(self, state):
+        '''
+        Return the action with the highest merged Q, search locally if no worker answered.
+        Return None if the game is over, like mcts.step.
+        '''
+        unique_actions = self.env_model.get_unique_actions(state)
+        if unique_actions == []:
+            return None
+        if len(unique_actions) == 1:
+            return unique_actions[0]
+        stats = self.search(state)
+        if stats == {}:
+            stats = {a: [n, q] for a, n, q in
+                     search_root(state, self.rollout_budget, self.time_budget)['children']}
+        return max(stats, key=lambda a: stats[a][1] / stats[a][0])
+
+
+def demo(num_workers, port, rollouts, seconds):
+    '''
+    Play one episode with local worker processes.
+    '''
+    processes, addresses = start_local_workers(num_workers, port)
+    time.sleep(0.5) # wait for workers to listen
+    coordinator = Coordinator(addresses, rollouts, seconds)
+    game = Game()
+    game.reset()
+    reward = 0
+    while game.is_end() is not True:
+        game.state['legal_actions'] = game.get_legal_actions(game.state)
+        action = coordinator.step(game.state)
+        state, action, next_state, reward, done = game.step(action)
+        print('action: {}, workers answered: {}/{}'.format(
+            action, len(coordinator.last_workers), len(addresses)))
+    print('reward: {}'.format(reward))
+    for p in processes:
+        p.terminate()
+
+
+###########################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distributed MCTS over TCP')
+    parser.add_argument('mode', choices=['worker', 'demo'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rollouts', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.mode == 'worker':
+        run_worker(args.port, args.host)
+    else:
+        demo(args.workers, args.port, args.rollouts, args.seconds)
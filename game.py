@@ -29,6 +29,7 @@ class Game():
         state (dict): A state stores observation and legal std_actions
         state = {'obs':obs, 'legal_actions':legal_actions}
         memory (list): A list of tuple (state, action, reward) 
+        initial_points (list of tuple): Candidate empty positions of a new game
         
         Returns
         -------
@@ -42,15 +43,24 @@ class Game():
         self.episodes = episodes
         self.state = {'obs': None, 'legal_actions':None}
         self.memory = []
+        self.initial_points = [(1, 0), (2, 0), (0, 1), (0, 2), (3, 0), (3, 1), (1, 3), (2, 3)]
         
-    def reset(self):
+        # Board symmetries, used to merge equivalent states in search
+        self.direc_offsets = [(-1, 0), (1, 0), (0, -1), (0, 1)] # up, down, left, right
+        self.symmetries = self.get_symmetries()
+        self.sym_index = self.get_symmetry_index()
+        self.sym_inverse = self.get_symmetry_inverse()
+        
+    def reset(self, init_point=None):
         ''' 
-        Reset game state and episode memory
+        Reset game state and episode memory.
+        The empty position is init_point (tuple) if given, else randomly chosen from initial_points.
         '''
         ROW, COL = self.ROW, self.COL
         self.state['obs'] = np.ones((ROW, COL))
-        initial_points = [(1, 0), (2, 0), (0, 1), (0, 2), (3, 0), (3, 1), (1, 3), (2, 3)]
-        self.state['obs'][random.choice(initial_points)] = 0
+        if init_point is None:
+            init_point = random.choice(self.initial_points)
+        self.state['obs'][init_point] = 0
         # self.state['obs'][np.random.randint(ROW), np.random.randint(COL)] = 0
         self.state['legal_actions'] = self.get_legal_actions(self.state)
         self.memory = []
@@ -106,6 +116,29 @@ class Game():
         return std_actions
     
     
+    def get_legal_actions_batch(self, obs):
+        '''
+        Return legal std_actions of a batch of boards, vectorized over the batch.
+
+        Parameters
+        ----------
+        obs (np.array): Boards of shape (N, ROW, COL)
+
+        Returns
+        -------
+        mask (np.array of bool): Shape (N, actions_num), mask[n, std_action] is True if legal
+
+        '''
+        ROW, COL = self.ROW, self.COL
+        b = np.asarray(obs) == 1
+        mask = np.zeros((b.shape[0], ROW, COL, 4), dtype=bool)
+        mask[:, 2:, :, 0] = b[:, 2:, :] & b[:, 1:-1, :] & ~b[:, :-2, :] # up
+        mask[:, :-2, :, 1] = b[:, :-2, :] & b[:, 1:-1, :] & ~b[:, 2:, :] # down
+        mask[:, :, 2:, 2] = b[:, :, 2:] & b[:, :, 1:-1] & ~b[:, :, :-2] # left
+        mask[:, :, :-2, 3] = b[:, :, :-2] & b[:, :, 1:-1] & ~b[:, :, 2:] # right
+        return mask.reshape(b.shape[0], ROW*COL*4)[:, :self.actions_num]
+    
+    
     def get_legal_pos(self, pos):
         '''
         Return all legal positions given a selected position
@@ -174,6 +207,169 @@ class Game():
         tmp = std_action // 4
         x, y = tmp // COL, tmp % COL
         return {'pos':(x, y), 'direc':direc}
+    
+    
+    def get_reward_range(self):
+        '''
+        Return bounds of the final reward, at least one and at most ROW*COL-1 chess are left.
+
+        Returns
+        -------
+        min_reward (int)
+        max_reward (int)
+
+        '''
+        return 8 - (self.ROW*self.COL - 1), 8 - 1
+    
+    
+    def get_next_obs(self, obs, std_action):
+        '''
+        Return the obs after taking std_action, without changing game state.
+        '''
+        obs = obs.copy()
+        raw_action = self.std_to_raw(std_action)
+        (x, y), direc = raw_action['pos'], raw_action['direc']
+        dx, dy = self.direc_offsets[direc]
+        obs[x, y] = 0
+        obs[x+dx, y+dy] = 0
+        obs[x+2*dx, y+2*dy] = 1
+        return obs
+    
+    
+    def get_symmetries(self):
+        '''
+        Return coordinate maps of all symmetries of the board.
+        A square board has 8 dihedral symmetries, a rectangular one has 4.
+
+        Returns
+        -------
+        symmetries (list of function): (x, y) -> (x', y')
+
+        '''
+        R, C = self.ROW - 1, self.COL - 1
+        symmetries = [lambda x, y: (x, y),         # identity
+                      lambda x, y: (R - x, C - y), # rotate 180
+                      lambda x, y: (x, C - y),     # flip left-right
+                      lambda x, y: (R - x, y)]     # flip up-down
+        if self.ROW == self.COL:
+            symmetries += [lambda x, y: (y, C - x),     # rotate 90
+                           lambda x, y: (C - y, x),     # rotate 270
+                           lambda x, y: (y, x),         # transpose
+                           lambda x, y: (C - y, R - x)] # anti-transpose
+        return symmetries
+    
+    
+    def get_symmetry_index(self):
+        '''
+        Precompute flat index arrays, so that a transformed obs is obs.flatten()[index].
+
+        Returns
+        -------
+        sym_index (list of np.array)
+
+        '''
+        ROW, COL = self.ROW, self.COL
+        sym_index = []
+        for sym in self.symmetries:
+            index = np.zeros(ROW*COL, dtype=int)
+            for i in range(ROW):
+                for j in range(COL):
+                    x, y = sym(i, j)
+                    index[x*COL + y] = i*COL + j
+            sym_index.append(index)
+        return sym_index
+    
+    
+    def get_symmetry_inverse(self):
+        '''
+        Return the id of the inverse of each symmetry.
+
+        Returns
+        -------
+        sym_inverse (list of int)
+
+        '''
+        identity = np.arange(self.ROW * self.COL)
+        sym_inverse = []
+        for index in self.sym_index:
+            for k, other in enumerate(self.sym_index):
+                if np.array_equal(index[other], identity):
+                    sym_inverse.append(k)
+                    break
+        return sym_inverse
+    
+    
+    def transform_obs(self, obs, sym):
+        '''
+        Apply symmetry sym (int) to an obs.
+        '''
+        return obs.flatten()[self.sym_index[sym]].reshape(self.ROW, self.COL)
+    
+    
+    def transform_action(self, std_action, sym):
+        '''
+        Map a std_action to the same move on the board transformed by symmetry sym (int).
+        '''
+        raw_action = self.std_to_raw(std_action)
+        (x, y), direc = raw_action['pos'], raw_action['direc']
+        dx, dy = self.direc_offsets[direc]
+        x1, y1 = self.symmetries[sym](x, y)
+        x2, y2 = self.symmetries[sym](x + dx, y + dy)
+        direc = self.direc_offsets.index((x2 - x1, y2 - y1))
+        return self.raw_to_std({'pos':(x1, y1), 'direc':direc})
+    
+    
+    def get_canonical(self, obs):
+        '''
+        Return the canonical form of an obs under the board symmetries.
+
+        Parameters
+        ----------
+        obs (np.array)
+
+        Returns
+        -------
+        key (bytes): Hashable key shared by all symmetric obs
+        sym (int): Id of the symmetry that maps obs to its canonical form
+
+        '''
+        flat = obs.flatten().astype(np.int8)
+        keys = [flat[index].tobytes() for index in self.sym_index]
+        key = min(keys)
+        return key, keys.index(key)
+    
+    
+    def get_unique_actions(self, state):
+        '''
+        Return legal std_actions, keeping one action for each group of
+        actions whose next states are symmetric to each other.
+
+        Returns
+        -------
+        std_actions (list of int)
+
+        '''
+        return list(self.get_action_groups(state).keys())
+    
+    
+    def get_action_groups(self, state):
+        '''
+        Group legal std_actions whose next states are symmetric to each other.
+
+        Returns
+        -------
+        action_groups (dict): {representative std_action: [std_actions of the group]},
+        the representative is the first legal action of its group
+
+        '''
+        action_groups, representatives = {}, {}
+        for std_action in state['legal_actions']:
+            key, _ = self.get_canonical(self.get_next_obs(state['obs'], std_action))
+            if key not in representatives:
+                representatives[key] = std_action
+                action_groups[std_action] = []
+            action_groups[representatives[key]].append(std_action)
+        return action_groups
         
         
     def step(self, std_action):
@@ -196,21 +392,7 @@ class Game():
 
         '''
         state = deepcopy(self.state) 
-        raw_action = self.std_to_raw(std_action)
-        (x, y), direc = raw_action['pos'], raw_action['direc']
-        self.state['obs'][x, y] = 0
-        if direc == 0: # up
-            self.state['obs'][x-1, y] = 0
-            self.state['obs'][x-2, y] = 1
-        elif direc == 1: # down
-            self.state['obs'][x+1, y] = 0
-            self.state['obs'][x+2, y] = 1
-        elif direc == 2: # left
-            self.state['obs'][x, y-1] = 0
-            self.state['obs'][x, y-2] = 1
-        elif direc == 3: # right
-            self.state['obs'][x, y+1] = 0
-            self.state['obs'][x, y+2] = 1
+        self.state['obs'] = self.get_next_obs(self.state['obs'], std_action)
         
         next_state = deepcopy(self.state)
         next_state['legal_actions'] = deepcopy(self.get_legal_actions(self.state))
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 import sys
 import math
+import time
 import random
 import numpy as np
 
 from copy import deepcopy
-from utils import is_array_in_list
+from collections import OrderedDict
 from utils import get_child_nodes_color
+from utils import get_node_memory
 
 class Node(object):
     """
@@ -20,6 +22,16 @@ class Node(object):
         self.quality_value = 0.0
         self.state = state
         self.action_to_state = action_to_state
+        # 对称合并后的可扩展动作，每组对称的子状态只保留一个动作
+        self.unique_actions = None
+        self.action_groups = None # {代表动作: 该组所有动作}
+        # AMAF 统计量：经过该节点的模拟中之后出现过的动作，{std_action: [visit_times, quality_value]}
+        self.amaf = {}
+        # 根节点记录：从该节点出发的模拟中找到的最好的完整动作序列
+        self.best_reward = None
+        self.best_actions = []
+        # 根节点记录：模拟中观察到的 reward 范围 [min, max]
+        self.reward_range = None
         
         # 绘制MC树时需要的变量
         self.depth = None
@@ -66,8 +78,35 @@ class Node(object):
     def quality_value_add_n(self, n):
         self.quality_value += n
 
+    def get_amaf(self, action):
+        return self.amaf.get(action, [0, 0.0])
+
+    def amaf_add(self, action, reward):
+        visit_times, quality_value = self.get_amaf(action)
+        self.amaf[action] = [visit_times + 1, quality_value + reward]
+
+    def update_reward_range(self, reward):
+        if self.reward_range is None:
+            self.reward_range = [reward, reward]
+        else:
+            self.reward_range = [min(self.reward_range[0], reward), max(self.reward_range[1], reward)]
+
+    def set_action_groups(self, action_groups):
+        self.action_groups = action_groups
+        self.unique_actions = list(action_groups.keys())
+    
+    def get_action_group(self, action):
+        if self.action_groups is None:
+            return [action]
+        return self.action_groups.get(action, [action])
+    
+    def get_unique_actions(self):
+        return self.unique_actions
+
     def is_all_expand(self):
-        return len(self.children) == len(self.state['legal_actions'])
+        if self.unique_actions is None:
+            return len(self.children) == len(self.state['legal_actions'])
+        return len(self.children) == len(self.unique_actions)
 
     def add_child(self, sub_node):
         sub_node.set_parent(self)
@@ -102,11 +141,49 @@ class mcts(object):
     def __init__(self):
         self.env_model = None
         self.root_node = Node(None, None)
+        self.root_key = None # canonical form of root obs
+        self.root_sym = 0 # symmetry mapping root obs to its canonical form
         self.nodes = []
+        self.rollout_budget = 100 # rollout times of each move
         self.rest_rollout_times = 0
+        self.time_budget = None # seconds of each move, no limit if None
+        self.search_start = None
+        self.move_done = False # whether an action has been returned from current root
+        
+        # 提前停止搜索
+        self.early_stop = True
+        self.confidence = 0.05 # 置信区间的错误概率
+        self.range_min_rollouts = 30 # 根节点模拟次数少于该值时，置信区间使用理论 reward 范围
+        self.saved_rollouts = [] # 每一步提前停止所节省的 rollout 次数
+        
+        # RAVE：在 best_child 中混合 AMAF 统计量，权重 beta = sqrt(k / (3n + k))
+        self.rave = False
+        self.rave_equivalence = 100 # k, AMAF 与真实 Q 值权重相等时的访问次数约为 k/3
+        self.playout_actions = [] # 最近一次模拟中执行的动作
+        
+        # 模拟策略，None 时均匀随机选择动作，否则使用在线学习的 RolloutPolicy
+        self.rollout_policy = None
+        
+        # 跨对局缓存搜索树，以根节点的规范形式为键，按内存 LRU 淘汰
+        # {root_key: {'root_node': Node, 'root_sym': int, 'nodes': list, 'memory': int}}
+        self.tree_cache = OrderedDict()
+        self.cache_max_memory = 64 * 2**20 # bytes
+        self.cache_memory = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
         
     def set_env_model(self, env_model_object):
         self.env_model = env_model_object
+    
+    def set_rollout_policy(self, rollout_policy):
+        self.rollout_policy = rollout_policy
+    
+    def feed_episode_ts(self, memory):
+        """
+        用一局游戏的记忆（Game 的 memory）在线学习模拟策略，未设置模拟策略时不做任何事。
+        """
+        if self.rollout_policy is not None:
+            self.rollout_policy.learn_from_memory(memory)
         
     def create_root_node(self, state):
         self.root_node = Node(deepcopy(state), None)
@@ -114,6 +191,8 @@ class mcts(object):
         self.root_node.set_depth(0)
         self.root_node.is_root_node = True
         self.root_node.set_child_nodes_color()
+        self.root_key, self.root_sym = self.env_model.get_canonical(state['obs'])
+        self.root_node.set_action_groups(self.env_model.get_action_groups(state))
         
         self.update_nodes_list(self.root_node)
     
@@ -129,12 +208,60 @@ class mcts(object):
         self.root_node = None
         
     def reset_rollout_times(self):
-        self.rest_rollout_times = 100
+        self.rest_rollout_times = self.rollout_budget
+    
+    def get_saved_rollouts(self):
+        return self.saved_rollouts
     
     def create_new_tree(self, state):
-        self.clear_nodes_list()
-        self.create_root_node(state)
+        self.update_cache_memory()
+        key, _ = self.env_model.get_canonical(state['obs'])
+        if key in self.tree_cache:
+            # Resume from the cached tree
+            self.cache_hits += 1
+            self.tree_cache.move_to_end(key)
+            entry = self.tree_cache[key]
+            self.root_node = entry['root_node']
+            self.root_key, self.root_sym = key, entry['root_sym']
+            self.nodes = entry['nodes']
+        else:
+            self.cache_misses += 1
+            self.clear_nodes_list()
+            self.create_root_node(state)
+            self.tree_cache[key] = {'root_node': self.root_node, 'root_sym': self.root_sym, 
+                                    'nodes': self.nodes, 'memory': 0}
+            self.add_cache_memory(self.root_node)
         self.reset_rollout_times()
+        self.search_start = time.time()
+        self.move_done = False
+    
+    def add_cache_memory(self, node):
+        """
+        把新建节点的内存估计累加到当前树的缓存项和缓存总内存上。
+        节点的估计只在创建时计算一次，之后子节点列表和 AMAF 统计量的增长不再计入，因此是略偏低的近似。
+        """
+        entry = self.tree_cache.get(self.root_key)
+        if entry is not None:
+            memory = get_node_memory(node)
+            entry['memory'] += memory
+            self.cache_memory += memory
+    
+    def update_cache_memory(self):
+        """
+        缓存总内存超过 cache_max_memory 时，按最近最少使用的顺序淘汰缓存的树。
+        """
+        while self.tree_cache and self.cache_memory > self.cache_max_memory:
+            key, entry = self.tree_cache.popitem(last=False)
+            self.cache_memory -= entry['memory']
+    
+    def get_cache_stats(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 
+                'trees': len(self.tree_cache), 'memory': self.cache_memory}
+    
+    def is_time_out(self):
+        if self.time_budget is None or self.root_node.get_children() == []:
+            return False
+        return time.time() - self.search_start >= self.time_budget
     
     def main(self, state):
       """
@@ -160,7 +287,7 @@ class mcts(object):
           reward = self.default_policy(expand_node)
     
           # 3. Update all passing nodes with reward
-          self.backup(expand_node, reward)
+          self.backup(expand_node, reward, self.playout_actions if self.rave else None)
     
       # N. Get the best next node
       best_next_node = self.best_child(root_node, False)
@@ -169,16 +296,113 @@ class mcts(object):
     
     
     def step(self, state):
+        key, sym = self.env_model.get_canonical(state['obs'])
         if self.root_node.get_state() is None:
             self.create_new_tree(state)
         else:
-            if list(self.root_node.get_state()['obs'].flatten()) != list(state['obs'].flatten()): # 即根节点更新时，更新整一颗树
+            if key != self.root_key or self.move_done: # 即根节点更新或开始新的一步时，更新整一颗树
                 self.create_new_tree(state)
             else:
                 self.rollout()
         
-        if self.rest_rollout_times == 0:
-            return self.best_child(self.root_node, False).get_action_to_state()
+        if self.root_node.get_unique_actions() == []: # 游戏已结束，没有可选的动作
+            return None
+        
+        if self.rest_rollout_times == 0 or self.is_time_out() or self.is_search_done():
+            if self.time_budget is None: # 按时间搜索时 rollout 预算不是真实的预算，不记录
+                self.saved_rollouts.append(self.rest_rollout_times)
+            if len(self.root_node.get_unique_actions()) == 1:
+                action = self.root_node.get_unique_actions()[0]
+            elif self.is_optimal_found():
+                action = self.root_node.best_actions[0]
+            elif self.early_stop:
+                action = self.most_visited_child(self.root_node).get_action_to_state()
+            else:
+                action = self.best_child(self.root_node, False).get_action_to_state()
+            self.move_done = True
+            return self.map_root_action(action, sym)
+    
+    
+    def most_visited_child(self, node):
+        """
+        提前停止时按访问次数选择子节点，访问次数相同时选 Q 值高的。
+        """
+        return max(node.get_children(), 
+                   key=lambda n: (n.get_visit_times(), n.get_quality_value() / n.get_visit_times()))
+    
+    
+    def is_search_done(self):
+        """
+        判断当前这一步是否可以提前停止搜索：
+        1. 只有一个可选的动作（对称的动作视为同一个），或已经找到理论最优的动作序列；
+        2. 剩余的 rollout 全部分配给其他子节点，其访问次数也无法超过访问次数最多的子节点；
+        3. Hoeffding 置信区间已经把访问次数最多的子节点与其他子节点分开。
+        根节点模拟次数达到 range_min_rollouts 之前使用理论 reward 范围；之后使用观察到的 reward 范围，
+        它只会低估真实范围，因此这时的区间是启发式的，并不是严格的 Hoeffding 界。
+        提前停止时最终按访问次数选择动作（见 most_visited_child）。
+        """
+        root_node = self.root_node
+        if len(root_node.get_unique_actions()) == 1 or self.is_optimal_found():
+            return True
+        if not self.early_stop or len(root_node.get_unique_actions()) < 2 or not root_node.is_all_expand():
+            return False
+        
+        best = self.most_visited_child(root_node)
+        others = [n for n in root_node.get_children() if n is not best]
+        
+        # The most visited child can not be overtaken within the rest rollouts
+        if best.get_visit_times() - max(n.get_visit_times() for n in others) > self.rest_rollout_times:
+            return True
+        
+        # Confidence bounds separate the most visited child from all others
+        if root_node.get_visit_times() < self.range_min_rollouts:
+            min_reward, max_reward = self.env_model.get_reward_range()
+        else:
+            min_reward, max_reward = root_node.reward_range
+        def radius(n):
+            return (max_reward - min_reward) * math.sqrt(math.log(2.0 / self.confidence) / (2.0 * n.get_visit_times()))
+        
+        lower = best.get_quality_value() / best.get_visit_times() - radius(best)
+        upper = max(n.get_quality_value() / n.get_visit_times() + radius(n) for n in others)
+        return lower > upper
+    
+    
+    def map_root_action(self, action, sym):
+        """
+        根节点可能是当前状态的对称状态，把根节点上的动作映射回当前状态，
+        sym 为当前状态到规范形式的对称变换。
+        """
+        action = self.env_model.transform_action(action, self.root_sym)
+        return self.env_model.transform_action(action, self.env_model.sym_inverse[sym])
+    
+    
+    def is_optimal_found(self):
+        return self.root_node.best_reward is not None and \
+            self.root_node.best_reward >= self.env_model.get_reward_range()[1]
+    
+    
+    def get_best_sequence(self, state):
+        """
+        返回当前根节点下找到的最好的完整动作序列及其 reward，动作已映射到 state 上，
+        可以直接依次执行而不再搜索。state 与根节点不对应时返回 (None, [])。
+        """
+        key, sym = self.env_model.get_canonical(state['obs'])
+        if key != self.root_key or self.root_node.best_reward is None:
+            return None, []
+        return self.root_node.best_reward, [self.map_root_action(a, sym) for a in self.root_node.best_actions]
+    
+    
+    def record_trajectory(self, node, reward):
+        """
+        记录从根节点到 node 的路径加上模拟中执行的动作，若 reward 比已有的更好则保存为最好的动作序列。
+        """
+        actions = []
+        while node.get_parent() is not None:
+            actions.append(node.get_action_to_state())
+            node = node.get_parent()
+        if node.best_reward is None or reward > node.best_reward:
+            node.best_reward = reward
+            node.best_actions = actions[::-1] + self.playout_actions
     
     
     def rollout(self):      
@@ -188,9 +412,11 @@ class mcts(object):
   
         # 2. Random run to add node and get reward
         reward = self.default_policy(expand_node)
+        self.record_trajectory(expand_node, reward)
+        self.root_node.update_reward_range(reward)
   
         # 3. Update all passing nodes with reward
-        self.backup(expand_node, reward)
+        self.backup(expand_node, reward, self.playout_actions if self.rave else None)
         
         self.rest_rollout_times -= 1
         
@@ -220,21 +446,17 @@ class mcts(object):
     def expand(self, node):
         """
         输入一个节点，在该节点上拓展一个新的节点，使用 random 方法执行 Action，返回新增的节点。
-        注意，需要保证新增的节点与其他节点 Action 不同。
+        注意，需要保证新增的节点与其他节点 Action 不同，且子状态互不对称，对称的子节点合并为一个，共享统计量。
         """
-        tried_sub_node_states = [
-            sub_node.get_state()['obs'] for sub_node in node.get_children()
-        ]
         print('expansion...')
-        # print('state of children nodes: {}'.format(tried_sub_node_states))
+        if node.get_unique_actions() is None:
+            node.set_action_groups(self.env_model.get_action_groups(node.get_state()))
+        
+        tried_actions = [sub_node.get_action_to_state() for sub_node in node.get_children()]
+        untried_actions = [a for a in node.get_unique_actions() if a not in tried_actions]
         
         self.env_model.set_state(node.get_state())
-        state, action, next_state, reward, done = self.env_model.random_step()      
-    
-        # Check until get the new state which has the different action from others
-        while is_array_in_list(next_state['obs'], tried_sub_node_states):
-            self.env_model.set_state(node.get_state())
-            state, action, next_state, reward, done = self.env_model.random_step()  
+        state, action, next_state, reward, done = self.env_model.step(random.choice(untried_actions))
         
         sub_node = Node(next_state, action)
         node.add_child(sub_node)
@@ -246,6 +468,7 @@ class mcts(object):
             sub_node.set_node_color(node.get_node_color())
         
         self.update_nodes_list(sub_node)
+        self.add_cache_memory(sub_node)
         return sub_node
   
     
@@ -253,23 +476,34 @@ class mcts(object):
         """
         蒙特卡罗树搜索的 Simulation 阶段，输入一个需要 expand 的节点，随机操作后创建新的节点，返回新增节点的 reward。
         注意输入的节点应该不是子节点，而且是有未执行的 Action可以 expend 的。
-        基本策略是随机选择Action。
+        基本策略是随机选择Action，若设置了 rollout_policy 则按其学习到的权重选择，并用模拟结果更新它。
+        执行过的动作记录在 self.playout_actions 中，用于更新 AMAF 统计量。
         """
         print('simulation...')
         # Get the state of the game
         current_state = deepcopy(node.get_state())
+        self.playout_actions = []
+        policy_keys = []
     
         # Run until the game over
         while current_state['legal_actions'] != []:
-            # Pick one random action to play and get next state
+            # Pick one action to play and get next state
             self.env_model.set_state(current_state)
-            state, action, next_state, reward, done = self.env_model.random_step()
+            if self.rollout_policy is None:
+                state, action, next_state, reward, done = self.env_model.random_step()
+            else:
+                action, key = self.rollout_policy.choose(current_state)
+                policy_keys.append(key)
+                state, action, next_state, reward, done = self.env_model.step(action)
+            self.playout_actions.append(action)
             current_state = next_state
             if done:
+                if self.rollout_policy is not None:
+                    self.rollout_policy.update(policy_keys, reward)
                 return reward
         
-        # If node is leaf
-        return 0
+        # If node is leaf, the game is already over
+        return 8 - current_state['obs'].sum()
     
     
     def best_child(self, node, is_exploration):
@@ -293,6 +527,19 @@ class mcts(object):
         # UCB = quality / times + C * sqrt(2 * ln(total_times) / times)
         left = sub_node.get_quality_value() / sub_node.get_visit_times()
         right = 2.0 * math.log(node.get_visit_times()) / sub_node.get_visit_times()
+        
+        # RAVE: blend Q with AMAF value of the same action, only when exploring.
+        # A merged child also takes AMAF of the actions symmetric to its own.
+        if self.rave and is_exploration:
+          amaf_visit_times, amaf_quality_value = 0, 0.0
+          for action in node.get_action_group(sub_node.get_action_to_state()):
+            visit_times, quality_value = node.get_amaf(action)
+            amaf_visit_times += visit_times
+            amaf_quality_value += quality_value
+          if amaf_visit_times > 0:
+            k = self.rave_equivalence
+            beta = math.sqrt(k / (3.0 * sub_node.get_visit_times() + k))
+            left = (1.0 - beta) * left + beta * amaf_quality_value / amaf_visit_times
         score = left + C * math.sqrt(right)
     
         if score > best_score:
@@ -302,11 +549,14 @@ class mcts(object):
       return best_sub_node
     
     
-    def backup(self, node, reward):
+    def backup(self, node, reward, actions=None):
       """
       蒙特卡洛树搜索的 Backpropagation 阶段，输入前面获取需要 expend 的节点和新执行 Action 的 reward，
       反馈给 expend 节点和上游所有节点并更新对应数据。
+      若给出模拟中执行的动作 actions，同时更新 AMAF 统计量：每个节点记录其之后出现过的所有动作（每个动作只计一次）。
       """
+      later_actions = set(actions) if actions is not None else None
+      
       # Update util the root node
       while node != None:
         # Update the visit times
@@ -314,6 +564,13 @@ class mcts(object):
     
         # Update the quality value
         node.quality_value_add_n(reward)
+        
+        # Update AMAF of all actions played after this node
+        if later_actions is not None:
+          for action in later_actions:
+            node.amaf_add(action, reward)
+          if node.get_action_to_state() is not None:
+            later_actions.add(node.get_action_to_state())
     
         # Change the node to the parent node
         node = node.parent
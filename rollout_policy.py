@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+'''
+Rollout policy learned online from finished playouts and episode memory.
+A move is keyed by its std_action and a local pattern: occupancy of the cells around the
+landing position of the jump. Symmetric moves share keys: a move is mapped to the canonical
+one of its orientations under the board symmetries, with its pattern cells read in the same
+orientation. The board is packed into an int once per move, and the key of
+each legal action is looked up from it in a precomputed table. Mean final rewards of keys are
+turned into sampling weights, which are refreshed in batches of playouts.
+
+Usage: python rollout_policy.py, to compare reward per CPU second with uniform rollouts.
+'''
+import time
+import random
+import argparse
+import numpy as np
+
+from game import Game
+
+
+class RolloutPolicy(object):
+    def __init__(self, env_model, beta=1.0, prior_times=10, refresh_interval=100):
+        '''
+        Parameters
+        ----------
+        env_model (Game)
+        beta (float): Inverse temperature, weight = exp(beta * mean_reward)
+        prior_times (int): Pseudo visit times of the global mean reward for each key
+        refresh_interval (int): Number of playouts between refreshes of sampling weights
+
+        '''
+        self.env_model = env_model
+        self.beta = beta
+        self.prior_times = prior_times
+        self.refresh_interval = refresh_interval
+        self.pending_playouts = 0
+        self.pending_keys, self.pending_rewards = [], [] # statistics not yet added to the table
+        self.pattern_cells = self.get_pattern_cells()
+        self.pattern_num = 2 ** max(len(cells) for cells in self.pattern_cells)
+
+        # A key is canonical std_action * pattern_num + pattern, looked up by the board bits under a mask
+        self.cell_bits = 2.0 ** np.arange(env_model.ROW * env_model.COL)
+        self.pattern_masks, self.key_index = self.get_key_index()
+
+        shape = (env_model.actions_num, self.pattern_num)
+        self.visit_times = np.zeros(shape)
+        self.quality_value = np.zeros(shape)
+        self.weights = [1.0] * (env_model.actions_num * self.pattern_num) # sampling weight of each key
+
+    def get_pattern_cells(self):
+        '''
+        For each std_action, return flat indices of the cells beyond the landing position
+        and beside it, which are inside the board.
+        '''
+        ROW, COL = self.env_model.ROW, self.env_model.COL
+        pattern_cells = []
+        for std_action in range(self.env_model.actions_num):
+            raw_action = self.env_model.std_to_raw(std_action)
+            (x, y), direc = raw_action['pos'], raw_action['direc']
+            dx, dy = self.env_model.direc_offsets[direc]
+            x, y = x + 2*dx, y + 2*dy # landing position
+            cells = []
+            for cx, cy in ((x + dx, y + dy), (x + 2*dx, y + 2*dy), (x + dy, y + dx), (x - dy, y - dx)):
+                if 0 <= cx < ROW and 0 <= cy < COL:
+                    cells.append(cx*COL + cy)
+            pattern_cells.append(cells)
+        return pattern_cells
+
+    def get_key_index(self):
+        '''
+        Precompute, for each std_action, the bit mask of its pattern cells and a dict
+        from board bits under the mask to the key. The key is taken from the canonical action,
+        the smallest std_action among the moves symmetric to it, and the pattern bits are read
+        from the cells of the canonical action mapped back to this orientation. If several
+        symmetries map the action to the canonical one, the smallest pattern is taken.
+
+        Returns
+        -------
+        pattern_masks (list of int)
+        key_index (list of dict): {board & mask: key}
+
+        '''
+        env_model = self.env_model
+        COL = env_model.COL
+        pattern_masks, key_index = [], []
+        for std_action in range(env_model.actions_num):
+            if std_action < env_model.ROW * COL * 4:
+                images = [env_model.transform_action(std_action, sym) for sym in range(len(env_model.symmetries))]
+            else: # off the board, never legal
+                images = [std_action]
+            canonical = min(images)
+            orientations = [] # pattern cells in the order of the canonical action, for each mapping symmetry
+            for sym, image in enumerate(images):
+                if image == canonical:
+                    inverse = env_model.symmetries[env_model.sym_inverse[sym]]
+                    orientations.append([inverse(cell // COL, cell % COL) for cell in self.pattern_cells[canonical]])
+            cells = [x*COL + y for x, y in orientations[0]]
+            pattern_masks.append(sum(1 << cell for cell in cells))
+            index = {}
+            for bits in range(2 ** len(cells)):
+                bits = sum(1 << cell for i, cell in enumerate(cells) if bits >> i & 1)
+                pattern = min(sum(1 << i for i, (x, y) in enumerate(orientation) if bits >> (x*COL + y) & 1)
+                              for orientation in orientations)
+                index[bits] = canonical * self.pattern_num + pattern
+            key_index.append(index)
+        return pattern_masks, key_index
+
+    def get_board(self, flat_obs):
+        return int(flat_obs.dot(self.cell_bits))
+
+    def get_key(self, flat_obs, std_action):
+        return self.key_index[std_action][self.get_board(flat_obs) & self.pattern_masks[std_action]]
+
+    def choose(self, state):
+        '''
+        Sample one legal std_action from the lookup table.
+
+        Returns
+        -------
+        std_action (int)
+        key (int): Key of the move, to be passed to update()
+
+        '''
+        board = self.get_board(state['obs'].ravel())
+        actions = state['legal_actions']
+        keys = [self.key_index[a][board & self.pattern_masks[a]] for a in actions]
+        weights = [self.weights[k] for k in keys]
+        r = random.random() * sum(weights)
+        for action, key, weight in zip(actions, keys, weights):
+            r -= weight
+            if r < 0:
+                break
+        return action, key
+
+    def update(self, keys, reward):
+        '''
+        Credit the final reward of a playout to the keys of all moves played in it.
+        Sampling weights are refreshed every refresh_interval playouts.
+        '''
+        self.pending_keys += keys
+        self.pending_rewards += [reward] * len(keys)
+        self.pending_playouts += 1
+        if self.pending_playouts >= self.refresh_interval:
+            self.update_weights()
+
+    def update_weights(self):
+        '''
+        Add pending statistics to the table and recompute sampling weights.
+        '''
+        np.add.at(self.visit_times.reshape(-1), self.pending_keys, 1)
+        np.add.at(self.quality_value.reshape(-1), self.pending_keys, self.pending_rewards)
+        self.pending_keys, self.pending_rewards, self.pending_playouts = [], [], 0
+        total_times = self.visit_times.sum()
+        if total_times == 0:
+            return
+        global_mean = self.quality_value.sum() / total_times
+        mean = (self.quality_value + self.prior_times * global_mean) / (self.visit_times + self.prior_times)
+        self.weights = np.exp(self.beta * (mean - global_mean)).ravel().tolist()
+
+    def learn_from_memory(self, memory):
+        '''
+        Learn from an episode memory of Game, a list of tuple (state, action, reward).
+        '''
+        if memory == []:
+            return
+        keys = [self.get_key(state['obs'].ravel(), action) for state, action, reward in memory]
+        self.update(keys, memory[-1][2])
+
+    def save(self, path):
+        self.update_weights()
+        np.savez(path, visit_times=self.visit_times, quality_value=self.quality_value)
+
+    def load(self, path):
+        data = np.load(path)
+        self.visit_times = data['visit_times']
+        self.quality_value = data['quality_value']
+        self.pending_keys, self.pending_rewards = [], []
+        self.update_weights()
+
+
+def playout(game, policy=None):
+    '''
+    Play from the current game state to the end, with policy or uniformly at random.
+
+    Returns
+    -------
+    reward (int)
+    keys (list of int): Keys of moves played, only if policy is given
+
+    '''
+    reward, keys = 0, []
+    while game.state['legal_actions'] != []:
+        if policy is None:
+            state, action, next_state, reward, done = game.random_step()
+        else:
+            action, key = policy.choose(game.state)
+            keys.append(key)
+            state, action, next_state, reward, done = game.step(action)
+        game.state['legal_actions'] = next_state['legal_actions']
+    return reward, keys
+
+
+def benchmark(train, test, seed, load=None, save=None):
+    '''
+    Train a policy on playouts, then compare reward per CPU second with uniform playouts.
+    The learned table is loaded from load (str) before training and saved to save (str) after it.
+    '''
+    random.seed(seed)
+    game = Game()
+    policy = RolloutPolicy(game)
+    if load is not None:
+        policy.load(load)
+    for i in range(train):
+        game.reset()
+        reward, keys = playout(game, policy)
+        policy.update(keys, reward)
+    if save is not None:
+        policy.save(save)
+
+    for name, p in (('uniform', None), ('learned', policy)):
+        random.seed(seed)
+        rewards = []
+        start = time.process_time()
+        for i in range(test):
+            game.reset()
+            rewards.append(playout(game, p)[0])
+        cpu_time = time.process_time() - start
+        print('{:<8} mean reward: {:.3f}, playouts per second: {:.0f}, reward per CPU second: {:.0f}'.format(
+            name, np.mean(rewards), test / cpu_time, np.sum(rewards) / cpu_time))
+
+
+###########################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rollout policy benchmark')
+    parser.add_argument('--train', type=int, default=2000, help='training playouts')
+    parser.add_argument('--test', type=int, default=2000, help='test playouts of each policy')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--load', default=None, help='load learned table (.npz) before training')
+    parser.add_argument('--save', default=None, help='save learned table (.npz) after training')
+    args = parser.parse_args()
+
+    benchmark(args.train, args.test, args.seed, args.load, args.save)
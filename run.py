@@ -30,10 +30,15 @@ class UserInterface():
         # Create Agent object
         self.agent = mcts()
         self.agent.set_env_model(Game())
+        # Learned rollout policy instead of random:
+        # from rollout_policy import RolloutPolicy; self.agent.set_rollout_policy(RolloutPolicy(Game()))
         
         # Record scores
         self.scores = []
         
+        # Remaining moves of the best sequence found by agent, replayed without search
+        self.max_length_track = []
+        
         # General args
         self.BoardColor = (246, 234, 219) # board color
         self.BgColor = (246, 234, 219) # Background color
@@ -129,23 +134,24 @@ class UserInterface():
                 if self.game.is_end() is not True:
                     # state (dict) : {'obs':obs, 'legal_actions':legal_actions} 
                     self.game.state['legal_actions'] = self.game.get_legal_actions(self.game.state)
-                    # action = self.agent.main(self.game.state)
-                    action = self.agent.step(self.game.state)
+                    if self.max_length_track != []:
+                        action = self.max_length_track.pop(0)
+                    else:
+                        # action = self.agent.main(self.game.state)
+                        action = self.agent.step(self.game.state)
+                        if action is not None and self.agent.is_optimal_found():
+                            self.max_length_track = self.agent.get_best_sequence(self.game.state)[1][1:]
                     if action is not None:
                         state, action, next_state, reward, done = self.game.step(action)
                         if done:
-                            # self.agent.feed_episode_ts(self.game.memory)
+                            self.agent.feed_episode_ts(self.game.memory)
                             self.record_score(reward)
                             self.game.episodes -= 1
                             self.game.reset()      
+                            self.max_length_track = []
                     self.time = time.time()
             else:
                 self.running = False
-                
-            # if self.max_length_track != []:
-            #     action = self.max_length_track.pop(0)
-            #     self.game.step(action)
-            #     self.time = time.time()
             
 
     def render(self): 
@@ -189,7 +195,7 @@ class UserInterface():
                 plot_one_node(color, center, radius)
         
         # Render Rollout times
-        text = 'Rollout times: ' + str(100 - self.agent.rest_rollout_times)
+        text = 'Rollout times: ' + str(self.agent.rollout_budget - self.agent.rest_rollout_times)
         render_text = self.font.render(text, True, (0,0,0))
         self.window.blit(render_text, (395, 20))
             
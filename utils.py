@@ -1,12 +1,30 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import random
+import sys
 
 
 def is_array_in_list(np_array, array_list):
     return list(np_array.flatten()) in [list(array.flatten()) for array in array_list]
 
 
+def get_node_memory(node):
+    '''
+    Estimate memory in bytes of a MC tree node, when it is created.
+    '''
+    memory = sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+    memory += node.state['obs'].nbytes + sys.getsizeof(node.state['legal_actions'])
+    memory += sys.getsizeof(node.children) + sys.getsizeof(node.amaf) + 64 * len(node.amaf)
+    return memory
+
+
+def get_nodes_memory(nodes):
+    '''
+    Estimate memory in bytes of a MC tree, given nodes list of each depth.
+    '''
+    return sum(get_node_memory(node) for layer_nodes in nodes for node in layer_nodes)
+
+
 def get_child_nodes_color(action_num):
     Red = (255, 0, 24)
     Green = (0, 128, 24)